@@ -0,0 +1,125 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# distutils: extra_compile_args = -O3 -march=native -ffast-math
+# distutils: sources = _stencil_avx.c
+"""
+Cython versions of the FDTD1 kernels in core.py. They do exactly 
+what the numba kernels _step and _sweep do, see there for the details.
+For float32 fields, they use the hand-vectorised AVX-512/AVX2 updates
+in _stencil_avx.c instead of the fused loop. Build in place with
+
+    cythonize -i _stencil.pyx
+
+and core.py will use them in preference to numba or numpy, whether
+or not numba is installed.
+"""
+from cython cimport floating
+
+cdef extern from "_stencil_avx.h" nogil:
+    void update_electric_avx(float *Ez, const float *Hy, float cc, Py_ssize_t lo, Py_ssize_t hi)
+    void update_magnetic_avx(const float *Ez, float *Hy, float cc, Py_ssize_t lo, Py_ssize_t hi)
+
+cdef inline void update_cells(floating[::1] Ez, floating[::1] Hy, floating cc,
+                              Py_ssize_t lo, Py_ssize_t hi) noexcept nogil:
+    # fused E and H update of cells lo to hi-1, none of which has a source
+    cdef Py_ssize_t n
+    cdef floating E
+    cdef floating E_left = Ez[lo-1]
+    for n in range(lo,hi):
+        E = Ez[n] + cc * (Hy[n-1]-Hy[n])
+        Ez[n] = E
+        Hy[n-1] = Hy[n-1] + cc * (E_left-E)
+        E_left = E
+
+cdef inline void update_cell(floating[::1] Ez, floating[::1] Hy, floating cc,
+                             Py_ssize_t N, Py_ssize_t n,
+                             Py_ssize_t e_position, Py_ssize_t h_position,
+                             bint hard, floating value) noexcept nogil:
+    # single cell, with the source applied between the E and H updates
+    cdef floating E = Ez[n]
+    if n < N-1:
+        E = E + cc * (Hy[n-1]-Hy[n])
+    if n == e_position:
+        E = value if hard else E + value
+    Ez[n] = E
+    if n-1 == h_position:
+        Hy[n-1] = value if hard else Hy[n-1] + value
+    Hy[n-1] = Hy[n-1] + cc * (Ez[n-1]-E)
+
+cdef inline void inject(floating[::1] F, Py_ssize_t position, bint hard,
+                        floating value) noexcept nogil:
+    F[position] = value if hard else F[position] + value
+
+cdef void step_cells(floating[::1] Ez, floating[::1] Hy, floating cc,
+                     Py_ssize_t N, Py_ssize_t lo, Py_ssize_t hi,
+                     Py_ssize_t e_position, Py_ssize_t h_position,
+                     bint hard, floating value) noexcept nogil:
+    cdef Py_ssize_t source = e_position if e_position >= 0 else h_position + 1
+    cdef Py_ssize_t n = lo
+    cdef Py_ssize_t last = hi if hi < N-1 else N-1
+    if floating is float:
+        # separate E and H passes over the cells, so each one vectorises;
+        # the H pass needs Ez[lo-1] and Hy[hi-1] as they are for the
+        # fused loop, so this is also valid for one row of a tile
+        update_electric_avx(&Ez[0], &Hy[0], cc, lo, last)
+        if source >= lo and source < hi:
+            if e_position >= 0:
+                inject(Ez, e_position, hard, value)
+            else:
+                inject(Hy, h_position, hard, value)
+        update_magnetic_avx(&Ez[0], &Hy[0], cc, lo-1, hi-1)
+    else:
+        if source >= lo and source < hi:
+            update_cells(Ez, Hy, cc, n, source)
+            update_cell(Ez, Hy, cc, N, source, e_position, h_position, hard, value)
+            n = source + 1
+        if n < last:
+            update_cells(Ez, Hy, cc, n, last)
+            n = last
+        if n < hi:
+            update_cell(Ez, Hy, cc, N, n, e_position, h_position, hard, value)
+
+cpdef step(floating[::1] Ez, floating[::1] Hy, floating cc, Py_ssize_t N,
+           Py_ssize_t e_position, Py_ssize_t h_position, bint hard,
+           floating value, bint mur, floating[::1] Mur_prev):
+    with nogil:
+        step_cells(Ez, Hy, cc, N, 1, N, e_position, h_position, hard, value)
+        if mur:
+            Ez[0] = Mur_prev[0]
+            Mur_prev[0] = Ez[1]
+            Ez[N-1] = Mur_prev[1]
+            Mur_prev[1] = Ez[N-2]
+
+cpdef sweep(floating[::1] Ez, floating[::1] Hy, floating cc, Py_ssize_t N,
+            Py_ssize_t e_position, Py_ssize_t h_position, bint hard,
+            floating[::1] values, bint mur, floating[::1] Mur_prev,
+            Py_ssize_t tile, Py_ssize_t sample_every,
+            floating[:, ::1] snapshots):
+    cdef Py_ssize_t n_steps = values.shape[0]
+    cdef Py_ssize_t t0, depth, a, k, lo, hi, step, first, n
+    if tile < 1:
+        raise ValueError("tile must be 1 or more, not %d"%tile) #or the loops never end
+    with nogil:
+        t0 = 0
+        while t0 < n_steps:
+            depth = tile if tile < n_steps - t0 else n_steps - t0
+            a = 1
+            while a < N + depth:
+                for k in range(depth):
+                    lo = a - k if a - k > 1 else 1
+                    hi = a + tile - k if a + tile - k < N else N
+                    if lo >= hi:
+                        continue
+                    step_cells(Ez, Hy, cc, N, lo, hi, e_position, h_position, hard, values[t0 + k])
+                    if mur and lo == 1:
+                        Ez[0] = Mur_prev[0]
+                        Mur_prev[0] = Ez[1]
+                    if mur and hi == N:
+                        Ez[N-1] = Mur_prev[1]
+                        Mur_prev[1] = Ez[N-2]
+                    step = t0 + k + 1
+                    if sample_every > 0 and step % sample_every == 0:
+                        first = 0 if lo == 1 else lo
+                        for n in range(first, hi):
+                            snapshots[step // sample_every - 1, n] = Ez[n]
+                a = a + tile
+            t0 = t0 + tile
@@ -0,0 +1,77 @@
+/*
+ * Hand-vectorised E and H updates for FDTD1, for float32 fields.
+ * Built into _stencil by _stencil.pyx, with -O3 -march=native so 
+ * that the AVX-512 or AVX2 loop is used if the CPU has it. Whatever
+ * is left over at the end of a loop is done one cell at a time.
+ *
+ * Ez has N cells and Hy has N-1, as in core.py. Each function does
+ * the cells from lo to hi-1, so that _stencil can call them for one 
+ * tile at a time as well as for the whole domain. On CPUs without
+ * AVX (e.g. ARM), only the one-cell-at-a-time loops are built.
+ */
+#if defined(__AVX512F__) || (defined(__AVX2__) && defined(__FMA__))
+#include <immintrin.h>
+#endif
+#include "_stencil_avx.h"
+
+void update_electric_avx(float *Ez, const float *Hy, float cc, ptrdiff_t lo, ptrdiff_t hi)
+{
+    /* Ez[i+1] += cc * (Hy[i] - Hy[i+1]) for i+1 = lo to hi-1 */
+    ptrdiff_t i = lo - 1;
+    ptrdiff_t M = hi - 1;
+#if defined(__AVX512F__)
+    __m512 cc_v = _mm512_set1_ps(cc);
+    for (; i + 16 <= M; i += 16) {
+        __m512 hL = _mm512_loadu_ps(&Hy[i]);
+        __m512 hR = _mm512_loadu_ps(&Hy[i+1]);
+        __m512 grad = _mm512_sub_ps(hL, hR);
+        __m512 e = _mm512_loadu_ps(&Ez[i+1]);
+        e = _mm512_fmadd_ps(cc_v, grad, e);
+        _mm512_storeu_ps(&Ez[i+1], e);
+    }
+#elif defined(__AVX2__) && defined(__FMA__)
+    __m256 cc_v = _mm256_set1_ps(cc);
+    for (; i + 8 <= M; i += 8) {
+        __m256 hL = _mm256_loadu_ps(&Hy[i]);
+        __m256 hR = _mm256_loadu_ps(&Hy[i+1]);
+        __m256 grad = _mm256_sub_ps(hL, hR);
+        __m256 e = _mm256_loadu_ps(&Ez[i+1]);
+        e = _mm256_fmadd_ps(cc_v, grad, e);
+        _mm256_storeu_ps(&Ez[i+1], e);
+    }
+#endif
+    for (; i < M; i++) {
+        Ez[i+1] += cc * (Hy[i] - Hy[i+1]);
+    }
+}
+
+void update_magnetic_avx(const float *Ez, float *Hy, float cc, ptrdiff_t lo, ptrdiff_t hi)
+{
+    /* Hy[i] += cc * (Ez[i] - Ez[i+1]) for i = lo to hi-1 */
+    ptrdiff_t i = lo;
+    ptrdiff_t M = hi;
+#if defined(__AVX512F__)
+    __m512 cc_v = _mm512_set1_ps(cc);
+    for (; i + 16 <= M; i += 16) {
+        __m512 eL = _mm512_loadu_ps(&Ez[i]);
+        __m512 eR = _mm512_loadu_ps(&Ez[i+1]);
+        __m512 grad = _mm512_sub_ps(eL, eR);
+        __m512 h = _mm512_loadu_ps(&Hy[i]);
+        h = _mm512_fmadd_ps(cc_v, grad, h);
+        _mm512_storeu_ps(&Hy[i], h);
+    }
+#elif defined(__AVX2__) && defined(__FMA__)
+    __m256 cc_v = _mm256_set1_ps(cc);
+    for (; i + 8 <= M; i += 8) {
+        __m256 eL = _mm256_loadu_ps(&Ez[i]);
+        __m256 eR = _mm256_loadu_ps(&Ez[i+1]);
+        __m256 grad = _mm256_sub_ps(eL, eR);
+        __m256 h = _mm256_loadu_ps(&Hy[i]);
+        h = _mm256_fmadd_ps(cc_v, grad, h);
+        _mm256_storeu_ps(&Hy[i], h);
+    }
+#endif
+    for (; i < M; i++) {
+        Hy[i] += cc * (Ez[i] - Ez[i+1]);
+    }
+}
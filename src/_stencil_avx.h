@@ -0,0 +1,12 @@
+/*
+ * Hand-vectorised E and H updates for FDTD1, see _stencil_avx.c
+ */
+#ifndef STENCIL_AVX_H
+#define STENCIL_AVX_H
+
+#include <stddef.h>
+
+void update_electric_avx(float *Ez, const float *Hy, float cc, ptrdiff_t lo, ptrdiff_t hi);
+void update_magnetic_avx(const float *Ez, float *Hy, float cc, ptrdiff_t lo, ptrdiff_t hi);
+
+#endif
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BatchedFDTD1 runs many independent FDTD1 simulations of the same
+size together on a CUDA GPU, e.g. for a parameter sweep over
+source position, dx or Courant factor. A single 1D simulation is
+too small to keep a GPU busy, but a batch of them is not.
+
+Needs cupy and numba (with CUDA support), and a CUDA GPU.
+"""
+import numpy as np
+from core import FDTD1, Field, Source, Boundary
+
+try:
+    import cupy as cp
+    from numba import cuda
+    HAVE_CUDA = cuda.is_available()
+except ImportError:
+    HAVE_CUDA = False
+
+if HAVE_CUDA:
+
+    @cuda.jit
+    def _iterate(Ez, Hy, cc, N, source_position, e_source, hard, values, mur, Mur_prev):
+        """
+        All the time steps for all the simulations in one launch. Ez
+        is (B, N) and Hy is (B, N-1), and each block is one simulation,
+        b, with its threads striding over the cells. The threads only
+        need to wait for each other within a simulation, so between
+        the E update, source, H update and boundary there is just a
+        syncthreads, instead of a kernel launch.
+        """
+        b = cuda.blockIdx.x
+        t = cuda.threadIdx.x
+        stride = cuda.blockDim.x
+        c = cc[b]
+        p = source_position[b]
+        for m in range(values.shape[0]):
+            for n in range(1 + t, N-1, stride):
+                Ez[b, n] = Ez[b, n] + c * (Hy[b, n-1]-Hy[b, n])
+            cuda.syncthreads()
+            if t == 0:
+                value = values[m, b]
+                if e_source:
+                    Ez[b, p] = value if hard else Ez[b, p] + value
+                else:
+                    Hy[b, p] = value if hard else Hy[b, p] + value
+            cuda.syncthreads()
+            for n in range(t, N-1, stride):
+                Hy[b, n] = Hy[b, n] + c * (Ez[b, n]-Ez[b, n+1])
+            cuda.syncthreads()
+            if mur and t == 0:
+                Ez[b, 0] = Mur_prev[b, 0]
+                Mur_prev[b, 0] = Ez[b, 1]
+                Ez[b, N-1] = Mur_prev[b, 1]
+                Mur_prev[b, 1] = Ez[b, N-2]
+            cuda.syncthreads()
+
+class BatchedFDTD1:
+
+    def __init__(self, simulations, threads = 128):
+        """
+        simulations is a list of FDTD1 objects, which must have the
+        same N, dtype, boundary type, source field, source type and
+        time step, but may differ in anything else (dx, Courant factor, source
+        position and waveform). Their current fields are copied to
+        the GPU, and copied back by to_host(). Each simulation is run
+        by one block of `threads` threads.
+        """
+        if not HAVE_CUDA:
+            raise ImportError("BatchedFDTD1 needs cupy, numba and a CUDA GPU")
+
+        if len(simulations) == 0:
+            raise ValueError("A batch must have at least one simulation")
+
+        first = simulations[0]
+        for sim in simulations:
+            if (sim.N != first.N or sim.dtype != first.dtype
+                or sim.boundary_type is not first.boundary_type
+                or sim.source_field is not first.source_field
+                or sim.source_type is not first.source_type
+                or sim.time_step != first.time_step):
+                raise ValueError("All simulations in a batch must have the same N, dtype, boundary type, source field, source type and time step")
+
+        self.simulations = simulations
+        self.B = len(simulations)
+        self.N = first.N
+        self.dtype = first.dtype
+        self.time_step = first.time_step
+        self.source_value = np.array([sim.source_value for sim in simulations])
+        self.threads = threads
+
+        self.Ez = cp.asarray(np.stack([sim.Ez for sim in simulations]))
+        self.Hy = cp.asarray(np.stack([sim.Hy for sim in simulations]))
+        self._mur = cp.asarray(np.stack([sim._mur for sim in simulations]))
+        self.cc = cp.asarray(np.array([sim.field_normalisation for sim in simulations], dtype=self.dtype))
+        self.source_position = cp.asarray(np.array([sim.source_position for sim in simulations], dtype=np.int64))
+
+    def iterate_n(self, n_steps):
+        """
+        Same result as calling iterate() n_steps times on each of the
+        simulations, in one kernel launch. The source values for all
+        the steps are worked out on the host, and copied to the GPU in
+        one go.
+        """
+        if n_steps < 0:
+            raise ValueError("n_steps must be 0 or more, not %d"%n_steps)
+
+        t0 = self.time_step + 1
+        values = np.stack([sim.get_source_values(t0, n_steps)
+                           for sim in self.simulations], axis=1)
+
+        first = self.simulations[0]
+        e_source = first.source_field is Field.ELECTRIC
+        hard = first.source_type is Source.HARD
+        mur = first.boundary_type is Boundary.MUR
+
+        if n_steps > 0:
+            _iterate[self.B, self.threads](self.Ez, self.Hy, self.cc, self.N,
+                                           self.source_position, e_source, hard,
+                                           cp.asarray(values), mur, self._mur)
+            self.source_value = values[-1]
+
+        self.time_step = self.time_step + n_steps
+
+    def to_host(self):
+        """
+        Copy the fields back into the FDTD1 objects in simulations,
+        e.g. for plotting
+        """
+        Ez = cp.asnumpy(self.Ez)
+        Hy = cp.asnumpy(self.Hy)
+        Mur_prev = cp.asnumpy(self._mur)
+        for b, sim in enumerate(self.simulations):
+            sim.Ez[:] = Ez[b]
+            sim.Hy[:] = Hy[b]
+            sim._mur[:] = Mur_prev[b]
+            sim.time_step = self.time_step
+            sim.source_value = float(self.source_value[b]) #as iterate leaves it
+
+
+if __name__ == "__main__":
+
+    import matplotlib.pyplot as plt
+
+    #sweep the source position across the domain
+    positions = range(10, 100, 10)
+    sims = [FDTD1(0.1,100,p, source_type = Source.SOFT, boundary_type = Boundary.MUR) for p in positions]
+    batch = BatchedFDTD1(sims)
+    batch.iterate_n(100)
+    batch.to_host()
+
+    plt.figure()
+    for offset, sim in enumerate(sims):
+        plt.plot(sim.Ez + offset)
+    plt.xlabel('Position (1/dx)')
+    plt.ylabel('E-field amplitude (V)')
+    plt.title('Soft Gaussian sources at different positions, step 100')
+    plt.show()
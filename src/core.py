@@ -8,10 +8,25 @@ calculations using
  - sources: soft or hard
 """
 from enum import Enum
-from math import exp, sin
+from math import exp, sin, cos
 import numpy as np
 from scipy.constants import speed_of_light, epsilon_0, mu_0
 
+try:
+    from numba import njit, prange, get_num_threads
+    HAVE_NUMBA = True
+except ImportError:
+    HAVE_NUMBA = False
+    
+try:
+    import _stencil #Cython kernels, see _stencil.pyx
+    HAVE_STENCIL = True
+except ImportError:
+    HAVE_STENCIL = False
+
+#Below this many cells, starting threads costs more than it saves
+PARALLEL_N = 100000
+
 class Source(Enum):
     HARD = 0
     SOFT = 1
@@ -28,6 +43,248 @@ class Boundary(Enum):
     BARE=0
     MUR=1
 
+def aligned_empty(shape, dtype, align=64):
+    """
+    Like np.empty, but the start of the array is on an `align` byte 
+    boundary (e.g. a cache line), by slicing a slightly larger byte 
+    buffer at the right offset
+    """
+    dtype = np.dtype(dtype)
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    buf = np.empty(nbytes + align, dtype=np.uint8)
+    offset = -buf.ctypes.data % align
+    return buf[offset:offset + nbytes].view(dtype).reshape(shape)
+
+if HAVE_NUMBA:
+    
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _update_cells(Ez, Hy, cc, lo, hi):
+        """
+        One time step of the E and H updates for cells lo to hi-1, fused
+        into a single pass. Hy[n-1] is updated as soon as Ez[n] is, 
+        carrying the new Ez[n-1] along in E_left, so each cell is only 
+        loaded once per step. Cells with a source, and the last cell, 
+        are left to _update_cell so that this loop has no branches.
+        """
+        E_left = Ez[lo-1]
+        for n in range(lo,hi):
+            E = Ez[n] + cc * (Hy[n-1]-Hy[n])
+            Ez[n] = E
+            Hy[n-1] = Hy[n-1] + cc * (E_left-E)
+            E_left = E
+            
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _update_cell(Ez, Hy, cc, N, n, e_position, h_position, hard, value):
+        """
+        As _update_cells, for the single cell n, applying the source 
+        at e_position (or h_position) in between the E and H updates,
+        i.e. at the same point as update_source in unfused updates. 
+        A position of -1 means there is no source on that field.
+        """
+        E = Ez[n]
+        if n < N-1:
+            E = E + cc * (Hy[n-1]-Hy[n])
+        if n == e_position:
+            E = value if hard else E + value
+        Ez[n] = E
+        if n-1 == h_position:
+            Hy[n-1] = value if hard else Hy[n-1] + value
+        Hy[n-1] = Hy[n-1] + cc * (Ez[n-1]-E)
+    
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _step_cells(Ez, Hy, cc, N, lo, hi, e_position, h_position, hard, value):
+        """
+        One time step for cells lo to hi-1, including the source
+        """
+        source = e_position if e_position >= 0 else h_position + 1
+        n = lo
+        if source >= lo and source < hi:
+            _update_cells(Ez, Hy, cc, n, source)
+            _update_cell(Ez, Hy, cc, N, source, e_position, h_position, hard, value)
+            n = source + 1
+        last = min(hi, N-1)
+        if n < last:
+            _update_cells(Ez, Hy, cc, n, last)
+            n = last
+        if n < hi:
+            _update_cell(Ez, Hy, cc, N, n, e_position, h_position, hard, value)
+    
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _step_row(Ez, Hy, cc, N, lo, hi, e_position, h_position, hard, value):
+        """
+        As _step_cells, but with separate E and H passes over the cells,
+        which have no dependency between cells and so vectorise. The H
+        pass needs Ez[lo-1] and Hy[hi-1] as they are for the fused loop,
+        so this is valid for one row of a tile in _sweep too. The loops
+        run over views starting at 0, because with a variable lo numba
+        can't tell the indices are never negative, and won't vectorise.
+        """
+        last = min(hi, N-1)
+        E = Ez[lo:last]
+        H_left = Hy[lo-1:last-1]
+        H_right = Hy[lo:last]
+        for i in range(last-lo):
+            E[i] = E[i] + cc * (H_left[i]-H_right[i])
+        if e_position >= lo and e_position < hi:
+            Ez[e_position] = value if hard else Ez[e_position] + value
+        if h_position >= lo-1 and h_position < hi-1:
+            Hy[h_position] = value if hard else Hy[h_position] + value
+        H = Hy[lo-1:hi-1]
+        E_left = Ez[lo-1:hi-1]
+        E_right = Ez[lo:hi]
+        for i in range(hi-lo):
+            H[i] = H[i] + cc * (E_left[i]-E_right[i])
+    
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _step(Ez, Hy, cc, N, e_position, h_position, hard, value, mur, Mur_prev):
+        """
+        One time step, followed by the Mur boundary if mur is True,
+        Mur_prev holds Ez[1] and Ez[-2] from the previous time step
+        """
+        _step_cells(Ez, Hy, cc, N, 1, N, e_position, h_position, hard, value)
+        if mur:
+            Ez[0] = Mur_prev[0]
+            Mur_prev[0] = Ez[1]
+            Ez[-1] = Mur_prev[1]
+            Mur_prev[1] = Ez[-2]
+        
+    @njit(cache=True, fastmath=True, boundscheck=False)
+    def _sweep(Ez, Hy, cc, N, e_position, h_position, hard, values, mur, Mur_prev, tile,
+               sample_every, snapshots):
+        """
+        Advance len(values) time steps using time skewing, see
+        Jin, Mellor-Crummey and Fowler, "Increasing temporal locality
+        with skewing and recursive blocking", SC2001.
+        
+        Updating cell n at one time step needs Hy[n] from the previous
+        time step, i.e. cell n+1 must be one step further on. So each
+        tile of cells is a parallelogram in (n, t) that moves one cell 
+        to the left per time step, and a tile is advanced through up 
+        to `tile` time steps while it is still in cache.
+        
+        If sample_every > 0, Ez after every sample_every-th step is
+        copied into the rows of snapshots, a tile at a time.
+        """
+        n_steps = len(values)
+        for t0 in range(0, n_steps, tile):
+            depth = min(tile, n_steps - t0)
+            for a in range(1, N + depth, tile):
+                for k in range(depth):
+                    lo = max(1, a - k)
+                    hi = min(N, a + tile - k)
+                    if lo >= hi:
+                        continue
+                    _step_row(Ez, Hy, cc, N, lo, hi, e_position, h_position, hard, values[t0 + k])
+                    if mur and lo == 1:
+                        Ez[0] = Mur_prev[0]
+                        Mur_prev[0] = Ez[1]
+                    if mur and hi == N:
+                        Ez[-1] = Mur_prev[1]
+                        Mur_prev[1] = Ez[-2]
+                    step = t0 + k + 1
+                    if sample_every > 0 and step % sample_every == 0:
+                        first = 0 if lo == 1 else lo #Ez[0] is only set by the boundary
+                        snapshots[step // sample_every - 1, first:hi] = Ez[first:hi]
+                        
+    @njit(parallel=True, cache=True, fastmath=True, boundscheck=False)
+    def _step_parallel(Ez, Hy, cc, N, e_position, h_position, hard, value, mur, Mur_prev):
+        """
+        As _step, but for large N, with the cells shared out between 
+        threads. The fused loop in _step carries Ez[n-1] from one cell
+        to the next, so here the E and H updates are separate passes, 
+        each of which has no dependency between cells.
+        """
+        for n in prange(1,N-1):
+            Ez[n] = Ez[n] + cc * (Hy[n-1]-Hy[n])
+        if e_position >= 0:
+            Ez[e_position] = value if hard else Ez[e_position] + value
+        if h_position >= 0:
+            Hy[h_position] = value if hard else Hy[h_position] + value
+        for n in prange(0,N-1):
+            Hy[n] = Hy[n] + cc * (Ez[n]-Ez[n+1])
+        if mur:
+            Ez[0] = Mur_prev[0]
+            Mur_prev[0] = Ez[1]
+            Ez[-1] = Mur_prev[1]
+            Mur_prev[1] = Ez[-2]
+            
+else:
+    # Without numba, whole-array slices keep the loops inside numpy
+    # Hy has length N-1 so the slices line up exactly
+    
+    def _inject_field(F, position, hard, value):
+        if position < 0:
+            return #no source on this field
+        if hard:
+            F[position] = value
+        else:
+            F[position] = F[position] + value
+    
+    def _step(Ez, Hy, cc, N, e_position, h_position, hard, value, mur, Mur_prev):
+        Ez[1:-1] += cc * (Hy[:-1] - Hy[1:])
+        _inject_field(Ez, e_position, hard, value)
+        _inject_field(Hy, h_position, hard, value)
+        Hy += cc * (Ez[:-1] - Ez[1:])
+        if mur:
+            Ez[0] = Mur_prev[0]
+            Mur_prev[0] = Ez[1]
+            Ez[-1] = Mur_prev[1]
+            Mur_prev[1] = Ez[-2]
+        
+    def _sweep(Ez, Hy, cc, N, e_position, h_position, hard, values, mur, Mur_prev, tile,
+               sample_every, snapshots):
+        # tiling does not help the slice updates, so just step through
+        for m, value in enumerate(values):
+            _step(Ez, Hy, cc, N, e_position, h_position, hard, value, mur, Mur_prev)
+            step = m + 1
+            if sample_every > 0 and step % sample_every == 0:
+                snapshots[step // sample_every - 1] = Ez
+
+if HAVE_STENCIL:
+    # the compiled Cython kernels, if built, take precedence
+    _step = _stencil.step
+    _sweep = _stencil.sweep
+
+#specialised kernels made by specialise_kernels, by (dtype, cc, parallel),
+#oldest first. Only the last few are kept, so a long sweep over the
+#Courant factor doesn't keep every one it has compiled
+_specialised = {}
+_SPECIALISED_MAX = 16
+
+def specialise_kernels(step, sweep, cc):
+    """
+    Versions of the numba kernels step and sweep with the field
+    normalisation cc compiled in as a constant, so it can be folded
+    into the updates. They take the same arguments as step and sweep,
+    and ignore the cc they are passed. Compiling them takes a few 
+    seconds for every new cc (which is the Courant factor, whatever 
+    dx is), and can't be cached between runs, so they are kept in _specialised
+    and shared by FDTD1 objects with the same cc and dtype. The numpy 
+    and Cython kernels are returned unchanged.
+    """
+    if not hasattr(step, 'py_func'):
+        return step, sweep
+    
+    key = (cc.dtype, cc, step is not _step)
+    if key in _specialised:
+        return _specialised[key]
+    
+    #not cached to disk, numba would use one cache entry for all values of cc
+    @njit(fastmath=True, boundscheck=False)
+    def step_cc(Ez, Hy, _cc, N, e_position, h_position, hard, value, mur, Mur_prev):
+        step(Ez, Hy, cc, N, e_position, h_position, hard, value, mur, Mur_prev)
+        
+    @njit(fastmath=True, boundscheck=False)
+    def sweep_cc(Ez, Hy, _cc, N, e_position, h_position, hard, values, mur, Mur_prev, tile,
+                 sample_every, snapshots):
+        sweep(Ez, Hy, cc, N, e_position, h_position, hard, values, mur, Mur_prev, tile,
+              sample_every, snapshots)
+        
+    if len(_specialised) >= _SPECIALISED_MAX:
+        del _specialised[next(iter(_specialised))]
+    _specialised[key] = step_cc, sweep_cc
+    return step_cc, sweep_cc
+
 class FDTD1:
     
     def __init__(self,
@@ -40,16 +297,20 @@ class FDTD1:
                  source_wave = Wave.GAUSSIAN,
                  boundary_type = Boundary.MUR,
                  allow_bad_Mur = False,
-                 Z = (1./(epsilon_0 * speed_of_light))):
+                 Z = (1./(epsilon_0 * speed_of_light)),
+                 dtype = np.float32,
+                 specialise = False):
         
         
-        if boundary_type == Boundary.MUR and Courant_factor != 0.5:
+        if boundary_type is Boundary.MUR and Courant_factor != 0.5:
             if allow_bad_Mur:
                 print("You are using the wrong courant factor")
             else:    
                 raise ValueError("For Mur boundary, courant must be set to default 0.5, not %f"%Courant_factor)
             
                 
+        self.dtype = np.dtype(dtype) #use np.float64 if you need the precision
+        self.specialise = specialise #see specialise_kernels, costs a compile per Courant factor
         self.boundary_type = boundary_type
         self.courant = Courant_factor
         self.init_boundaries()
@@ -61,18 +322,34 @@ class FDTD1:
         self.time_step = 0 #current time step
         self.Z = Z
         
+        if not (source_field is Field.ELECTRIC or source_field is Field.MAGNETIC):
+            raise TypeError("Unknown field type: Source field should be Field.ELECTRIC or Field.MAGNETIC")
+            
         self.source_field = source_field
         
-        if (source_position < 1) or (source_position >= N):
-            raise ValueError("source position %d is outside the valid positions of [1:(N-1)] i.e. [1:%d]"%(source_position,N-1))
+        #Hy has one cell fewer than Ez
+        last = N-1 if source_field is Field.ELECTRIC else N-2
+        if (source_position < 1) or (source_position > last):
+            raise ValueError("source position %d is outside the valid positions of [1:%d] for the %s field"%(source_position,last,source_field.name.lower()))
         
         self.source_position = source_position
-        if not (source_wave == Wave.GAUSSIAN or source_wave == Wave.SINE):
+        if not (source_wave is Wave.GAUSSIAN or source_wave is Wave.SINE):
             raise TypeError("Unknown wave type: Source wave should be Wave.GAUSSIAN or Wave.SINE")
         
+        if not (source_type is Source.HARD or source_type is Source.SOFT):
+            raise TypeError("Unknown source type: Source type should be Source.HARD or Source.SOFT")
+            
         self.source_type = source_type
         self.source_wave = source_wave
-        self.source_value = 0
+        self.source_value = 0.0
+        
+        #chosen once here, so update_source does not have to branch
+        self._inject = {(Field.ELECTRIC, Source.HARD): self.hard_electric,
+                        (Field.ELECTRIC, Source.SOFT): self.soft_electric,
+                        (Field.MAGNETIC, Source.HARD): self.hard_magnetic,
+                        (Field.MAGNETIC, Source.SOFT): self.soft_magnetic,
+                        }[(source_field, source_type)]
+        
         self.init_source()
         self.init_update_fields()
         
@@ -82,6 +359,12 @@ class FDTD1:
         
     def soft_electric(self, n, E):
         self.Ez[n] = self.Ez[n] + E
+        
+    def hard_magnetic(self, n, H):
+        self.Hy[n] = H
+        
+    def soft_magnetic(self, n, H):
+        self.Hy[n] = self.Hy[n] + H
 
     def init_gaussian(self, temporal_delay=30, pulse_width=10):
         """ 
@@ -91,20 +374,32 @@ class FDTD1:
         """  
         self.gaussian_delay = temporal_delay
         self.gaussian_width = pulse_width
-        self.gaussian_value = 0
+        self._source_schedule = None
             
     def init_sine(self, omega, magnitude = 1):
         self.sine_omega = omega
         self.sine_magnitude = magnitude
-        self.sine_value = 0
+        self._source_schedule = None
+        #sin(omega*dt*m) obeys s[m+1] = 2cos(omega*dt)s[m] - s[m-1]
+        self._sine_c = 2 * cos(omega * self.dt)
+        self.seed_sine(1)
+        
+    def seed_sine(self, m):
+        """
+        Start the sine recurrence at time step m
+        """
+        omega_dt = self.sine_omega * self.dt
+        self._sine_prev = sin(omega_dt * (m-1))
+        self._sine_curr = sin(omega_dt * m)
+        self._sine_step = m
     
     def init_source(self):
         #Provide usable default sources, for convenience
         
-        if self.source_wave == Wave.GAUSSIAN:
+        if self.source_wave is Wave.GAUSSIAN:
             self.init_gaussian()
             
-        if self.source_wave == Wave.SINE:    
+        if self.source_wave is Wave.SINE:    
             self.init_sine(0.3/self.dt)
         
     def update_gaussian(self):
@@ -121,52 +416,88 @@ class FDTD1:
         t = m *dt 
         then the source is
         sin(omega * m * dt) 
+        which we get from the previous two values, rather than calling
+        sin every time step. If the time step has jumped (e.g. after
+        iterate_n), the recurrence is started again from there.
         """
-        sine = sin(self.sine_omega * self.dt * self.time_step)
-        self.sine_value = self.sine_magnitude * sine
+        m = self.time_step
+        if m == self._sine_step + 1:
+            sine = self._sine_c * self._sine_curr - self._sine_prev
+            self._sine_prev = self._sine_curr
+            self._sine_curr = sine
+            self._sine_step = m
+        elif m != self._sine_step:
+            self.seed_sine(m)
+        self.sine_value = self.sine_magnitude * self._sine_curr
         
      
-    def update_source(self):    
+    def get_source_values(self, t0, n_steps):
+        """
+        Source waveform for time steps t0 to t0+n_steps-1, in one
+        vectorised np.exp or np.sin call, using the same expressions
+        as update_gaussian and update_sine
+        """
+        m = np.arange(t0, t0+n_steps)
+        
+        if self.source_wave is Wave.GAUSSIAN:
+            arg = ((m-self.gaussian_delay)/self.gaussian_width)**2
+            values = np.exp(-arg)
+            
+        if self.source_wave is Wave.SINE:
+            values = self.sine_magnitude * np.sin(self.sine_omega * self.dt * m)
+            
+        return values.astype(self.dtype, copy=False)
+        
+    def precompute_source(self, n_steps):
+        """
+        Calculate the source waveform for time steps 0 to n_steps-1
+        in one go, so that update_source_value can look it up instead
+        of calling exp or sin every time step. Later time steps are
+        calculated as usual.
+        """
+        self._source_schedule = self.get_source_values(0, n_steps)
+        
+    def update_source_value(self):    
         """
         Update self.source_value with current source waveform value
         """
-        if self.source_wave == Wave.GAUSSIAN:
+        schedule = self._source_schedule
+        time_step = self.time_step
+        if schedule is not None and time_step < len(schedule):
+            self.source_value = schedule[time_step]
+            return
+        
+        if self.source_wave is Wave.GAUSSIAN:
             self.update_gaussian()
             self.source_value = self.gaussian_value
               
-        if self.source_wave == Wave.SINE:    
+        if self.source_wave is Wave.SINE:    
             self.update_sine() 
             self.source_value = self.sine_value
             
-        if self.source_field == Field.ELECTRIC:
-            
-            if self.source_type == Source.HARD:
-                
-                self.Ez[self.source_position] = self.source_value
-            
-            if self.source_type == Source.SOFT:
-                
-                self.Ez[self.source_position] = self.Ez[self.source_position] + self.source_value
-            
-                       
-        if self.source_field== Field.MAGNETIC:
-            
-            if self.source_type == Source.HARD:
-                
-                self.Hy[self.source_position] = self.source_value
-            
-            if self.source_type == Source.SOFT:
-                
-                self.Hy[self.source_position] = self.Hy[self.source_position] + self.source_value
+    def update_source(self):    
+        """
+        Update self.source_value and apply it to the source field
+        """
+        self.update_source_value()
+        self._inject(self.source_position, self.source_value)
     
     def init_fields(self, N):
         """
         Ez[0] is to the left of Hy[0]
         i.e. Ez[0]       Ez[1]        Ez[2]
                    Hy[0]       Hy[1]        ...
+                   
+        Ez and Hy are rows of one 64-byte aligned buffer, _buf, padded
+        by one cache line at each end, so both start on a cache line and
+        vector loads at the ends of the domain stay inside the buffer
         """
-        self.Ez = np.array(np.zeros(N), dtype=float)
-        self.Hy = np.array(np.zeros(N-1), dtype=float) 
+        pad = 64 // self.dtype.itemsize
+        row = -(-(N + 2*pad) // pad) * pad #round up so each row is aligned
+        self._buf = aligned_empty((2, row), self.dtype)
+        self._buf.fill(0)
+        self.Ez = self._buf[0, pad:pad+N]
+        self.Hy = self._buf[1, pad:pad+N-1]
            
     def init_update_fields(self):
         """
@@ -174,36 +505,89 @@ class FDTD1:
         https://my.ece.utah.edu/~ece6340/LECTURES/lecture%2014/FDTD.pdf
         For Taflove's normalisation of the fields
         """
-        self.field_normalisation = 1/(mu_0 * epsilon_0)**0.5 * self.dt / self.dx
+        cc = 1/(mu_0 * epsilon_0)**0.5 * self.dt / self.dx
+        self.field_normalisation = self.dtype.type(cc) #keeps the kernels in self.dtype
+        
+        #_step is the Cython kernel if it is built, which beats the threads
+        if (HAVE_NUMBA and not HAVE_STENCIL and self.N >= PARALLEL_N 
+            and get_num_threads() > 1):
+            step = _step_parallel
+        else:
+            step = _step
+        #the tiled _sweep works in cache, so stays serial for large N too
+        sweep = _sweep
+            
+        if self.specialise:
+            step, sweep = specialise_kernels(step, sweep, self.field_normalisation)
+        self._step = step
+        self._sweep = sweep
+            
+        self.warm_kernels()
+        
+    def warm_kernels(self):
+        """
+        Call the kernels once on size-1 arrays so that the JIT compile
+        (or loading it from numba's cache) happens here and not during
+        the first time step
+        """
+        if not hasattr(self._step, 'py_func'):
+            return #only numba kernels need compiling
+        Ez = np.zeros(1, dtype=self.dtype)
+        Hy = np.zeros(1, dtype=self.dtype)
+        value = self.dtype.type(0)
+        Mur_prev = np.zeros(2, dtype=self.dtype)
+        self._step(Ez, Hy, self.field_normalisation, 1, -1, -1, False, value, False, Mur_prev)
+        self._sweep(Ez, Hy, self.field_normalisation, 1, -1, -1, False, 
+                    np.zeros(1, dtype=self.dtype), False, Mur_prev, 1,
+                    0, np.zeros((0, 1), dtype=self.dtype))
         
-    def update_fields(self):
+    def get_source_target(self):
+        """
+        Positions of the source in Ez and Hy for the kernels, with -1 
+        for the field without a source, and whether the source is hard
+        """
+        e_position = self.source_position if self.source_field is Field.ELECTRIC else -1
+        h_position = self.source_position if self.source_field is Field.MAGNETIC else -1
+        hard = self.source_type is Source.HARD
+        return e_position, h_position, hard
         
+    def update_fields(self, boundaries=False):
+        """
+        The source is injected inside _step, between the E and H updates.
+        With boundaries=True, _step also does update_boundaries, so that
+        iterate only needs one kernel call per time step.
+        """
+        Ez = self.Ez
+        Hy = self.Hy
         cc = self.field_normalisation
+        N = self.N
         
-        for n in range(1,self.N-1):
-            self.Ez[n] = self.Ez[n] + cc * (self.Hy[n-1]-self.Hy[n])
-            
-        self.update_source()   
+        self.update_source_value()
+        
+        e_position, h_position, hard = self.get_source_target()
         
-        for n in range(0,self.N-1):
-            self.Hy[n] = self.Hy[n] + cc * (self.Ez[n]-self.Ez[n+1])       
+        value = self.dtype.type(self.source_value)
+        
+        mur = boundaries and self.boundary_type is Boundary.MUR
+        
+        self._step(Ez, Hy, cc, N, e_position, h_position, hard, value, mur, self._mur)
 
         
     def init_boundaries(self):
-        if self.boundary_type == Boundary.BARE:
-            return #nothing to do
-        if self.boundary_type == Boundary.MUR:
-            self.MurE0previous = 0
-            self.MurENprevious = 0
+        #the kernels take the Mur state whatever the boundary, so always make it
+        #_mur[0] is Ez[1] and _mur[1] is Ez[-2] from the previous time step
+        self._mur = np.zeros(2, dtype=self.dtype)
             
     def update_boundaries(self):
-        if self.boundary_type == Boundary.BARE:
+        if self.boundary_type is Boundary.BARE:
             return #nothing to do
-        if self.boundary_type == Boundary.MUR:
-            self.Ez[0] = self.MurE0previous
-            self.MurE0previous = self.Ez[1]
-            self.Ez[-1] = self.MurENprevious
-            self.MurENprevious = self.Ez[-2]
+        if self.boundary_type is Boundary.MUR:
+            Ez = self.Ez
+            Mur_prev = self._mur
+            Ez[0] = Mur_prev[0]
+            Mur_prev[0] = Ez[1]
+            Ez[-1] = Mur_prev[1]
+            Mur_prev[1] = Ez[-2]
    
     def get_dt(self, courant, dx):
         return courant * dx / speed_of_light
@@ -211,8 +595,55 @@ class FDTD1:
     
     def iterate(self):
         self.time_step = self.time_step + 1
-        self.update_fields()
-        self.update_boundaries()
+        self.update_fields(boundaries=True)
+        
+    def iterate_n(self, n_steps, tile=4096, sample_every=None):
+        """
+        Same result as calling iterate() n_steps times, but all the
+        steps are run by one _sweep call, which works through the 
+        domain in tiles of `tile` cells and advances each tile through 
+        several time steps while it is in cache. This helps when N is
+        too large for the fields to stay in cache between time steps.
+        
+        If sample_every is given, returns an array with a copy of Ez 
+        after every sample_every-th step, i.e. one row per snapshot
+        """
+        if n_steps < 0:
+            raise ValueError("n_steps must be 0 or more, not %d"%n_steps)
+        if tile < 1:
+            raise ValueError("tile must be 1 or more, not %d"%tile)
+        if sample_every is not None and sample_every < 1:
+            raise ValueError("sample_every must be 1 or more, not %d"%sample_every)
+            
+        t0 = self.time_step + 1
+        values = self.get_source_values(t0, n_steps)
+        
+        schedule = self._source_schedule
+        if schedule is not None and t0 < len(schedule):
+            #use the table where it covers these steps, as iterate would
+            k = min(len(schedule) - t0, n_steps)
+            values[:k] = schedule[t0:t0+k]
+            
+        self.time_step = self.time_step + n_steps
+        if n_steps > 0:
+            self.source_value = values[-1]
+                
+        e_position, h_position, hard = self.get_source_target()
+        
+        mur = self.boundary_type is Boundary.MUR
+        
+        if sample_every is None:
+            snapshots = np.zeros((0, self.N), dtype=self.dtype)
+            sample_every = 0
+        else:
+            snapshots = np.zeros((n_steps // sample_every, self.N), dtype=self.dtype)
+            
+        self._sweep(self.Ez, self.Hy, self.field_normalisation, self.N, 
+                    e_position, h_position, hard, values, mur, self._mur, tile,
+                    sample_every, snapshots)
+        
+        if sample_every > 0:
+            return snapshots
         
     
 if __name__ == "__main__":
@@ -220,11 +651,7 @@ if __name__ == "__main__":
     import matplotlib.pyplot as plt
      
     demo = FDTD1(0.1,50,25, source_wave = Wave.GAUSSIAN, source_type = Source.HARD, boundary_type = Boundary.MUR) 
-    source = []
-    for n in range(100):
-        demo.time_step = demo.time_step + 1
-        demo.update_source()
-        source.append(demo.source_value)
+    source = demo.get_source_values(1, 100)
     plt.figure()    
     plt.plot(source)    
     plt.xlabel('time step')     
@@ -233,11 +660,7 @@ if __name__ == "__main__":
     plt.savefig('../img/gaussian_source.png', dpi=100)
         
     demo = FDTD1(0.1,50,25, source_wave = Wave.SINE, source_type = Source.HARD, boundary_type = Boundary.MUR) 
-    source = []
-    for n in range(100):
-        demo.time_step = demo.time_step + 1
-        demo.update_source()
-        source.append(demo.source_value)
+    source = demo.get_source_values(1, 100)
     plt.figure()    
     plt.plot(source)    
     plt.xlabel('time step')     
@@ -246,14 +669,11 @@ if __name__ == "__main__":
     plt.savefig('../img/sine_source.png', dpi=100)
         
     demo = FDTD1(0.1,100,50, source_wave = Wave.GAUSSIAN, source_type = Source.SOFT, boundary_type = Boundary.BARE) 
-    source = []
     plt.figure()
     offset = 0
-    for n in range(400):
-        demo.iterate()
-        if n%10==0:
-            plt.plot(demo.Ez + offset)
-            offset = offset + 1
+    for Ez in demo.iterate_n(400, sample_every=10):
+        plt.plot(Ez + offset)
+        offset = offset + 1
    
     plt.xlabel('Position (1/dx)')     
     plt.ylabel('E-field amplitude (V)')
@@ -263,14 +683,11 @@ if __name__ == "__main__":
     fig.savefig('../img/bare_gaussian_soft.png', dpi=100)
     
     demo = FDTD1(0.1,100,50, source_wave = Wave.GAUSSIAN, source_type = Source.HARD, boundary_type = Boundary.BARE) 
-    source = []
     plt.figure()
     offset = 0
-    for n in range(400):
-        demo.iterate()
-        if n%10==0:
-            plt.plot(demo.Ez + offset)
-            offset = offset + 1
+    for Ez in demo.iterate_n(400, sample_every=10):
+        plt.plot(Ez + offset)
+        offset = offset + 1
    
     plt.xlabel('Position (1/dx)')     
     plt.ylabel('E-field amplitude (V)')
@@ -280,14 +697,11 @@ if __name__ == "__main__":
     fig.savefig('../img/bare_gaussian_hard.png', dpi=100)   
 
     demo = FDTD1(0.1,100,50, source_wave = Wave.GAUSSIAN, source_type = Source.SOFT, boundary_type = Boundary.MUR) 
-    source = []
     plt.figure()
     offset = 0
-    for n in range(400):
-        demo.iterate()
-        if n%10==0:
-            plt.plot(demo.Ez + offset)
-            offset = offset + 1
+    for Ez in demo.iterate_n(400, sample_every=10):
+        plt.plot(Ez + offset)
+        offset = offset + 1
    
     plt.xlabel('Position (1/dx)')     
     plt.ylabel('E-field amplitude (V)')
@@ -302,14 +716,11 @@ if __name__ == "__main__":
                  boundary_type = Boundary.MUR,
                  Courant_factor = 1,
                  allow_bad_Mur = True) 
-    source = []
     plt.figure()
     offset = 0
-    for n in range(400):
-        demo.iterate()
-        if n%10==0:
-            plt.plot(demo.Ez + offset)
-            offset = offset + 1
+    for Ez in demo.iterate_n(400, sample_every=10):
+        plt.plot(Ez + offset)
+        offset = offset + 1
    
     plt.xlabel('Position (1/dx)')     
     plt.ylabel('E-field amplitude (V)')
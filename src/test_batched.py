@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks that BatchedFDTD1 gives the same fields as calling iterate()
+on each simulation. Needs cupy, numba and a CUDA GPU, and is skipped
+otherwise. Run from this directory with
+
+    python -m unittest test_batched
+"""
+import unittest
+import numpy as np
+import core
+import batched
+
+@unittest.skipUnless(batched.HAVE_CUDA, "needs cupy, numba and a CUDA GPU")
+class BatchedTest(unittest.TestCase):
+
+    def make(self, field, kind, boundary):
+        #differ in dx, source position and waveform
+        return [core.FDTD1(dx, 60, position, source_field=field, source_type=kind,
+                           source_wave=wave, boundary_type=boundary)
+                for dx, position, wave in ((0.1, 10, core.Wave.GAUSSIAN),
+                                           (0.2, 30, core.Wave.SINE),
+                                           (0.05, 58, core.Wave.GAUSSIAN))]
+
+    def test_same_as_iterate(self):
+        for field in core.Field:
+            for kind in core.Source:
+                for boundary in core.Boundary:
+                    for threads in (16, 128):
+                        with self.subTest(field=field, kind=kind, boundary=boundary,
+                                          threads=threads):
+                            sims = self.make(field, kind, boundary)
+                            refs = self.make(field, kind, boundary)
+                            batch = batched.BatchedFDTD1(sims, threads=threads)
+                            batch.iterate_n(30)
+                            batch.iterate_n(7)
+                            batch.to_host()
+                            for sim, ref in zip(sims, refs):
+                                for n in range(37):
+                                    ref.iterate()
+                                #the GPU may contract to FMA where the CPU doesn't
+                                np.testing.assert_allclose(sim.Ez, ref.Ez, rtol=0, atol=1e-5)
+                                np.testing.assert_allclose(sim.Hy, ref.Hy, rtol=0, atol=1e-5)
+                                self.assertEqual(sim.time_step, ref.time_step)
+                                self.assertIsInstance(sim.source_value, float)
+
+    def test_empty(self):
+        with self.assertRaises(ValueError):
+            batched.BatchedFDTD1([])
+
+if __name__ == "__main__":
+    unittest.main()
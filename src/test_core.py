@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Checks that iterate_n gives the same fields as calling iterate() the
+same number of times, for each of the kernel backends that can be
+loaded here (numpy, numba, and Cython if _stencil has been built).
+Run from this directory with
+
+    python -m unittest test_core
+"""
+import importlib.util
+import os
+import sys
+import unittest
+import numpy as np
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+def load_core(backend):
+    """
+    A fresh copy of core.py, with the kernels from backend, which is
+    'numpy', 'numba' or 'cython'. Returns None if it is not available
+    """
+    blocked = []
+    if backend == 'numpy':
+        blocked = ['numba', '_stencil']
+    elif backend == 'numba':
+        blocked = ['_stencil']
+    #a None entry in sys.modules makes the import in core.py fail
+    saved = {name: sys.modules.get(name) for name in blocked}
+    sys.modules.update({name: None for name in blocked})
+    #numba's cache stores the module name of the kernels, so keep the
+    #numba copy as core, and the others (whose numba kernels are never
+    #compiled) under names of their own
+    name = 'core' if backend == 'numba' else 'core_' + backend
+    try:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, 'core.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    finally:
+        for name, old in saved.items():
+            if old is None:
+                del sys.modules[name]
+            else:
+                sys.modules[name] = old
+    if backend == 'numba' and not module.HAVE_NUMBA:
+        return None
+    if backend == 'cython' and not module.HAVE_STENCIL:
+        return None
+    return module
+
+BACKENDS = {backend: load_core(backend) for backend in ('numpy', 'numba', 'cython')}
+
+N = 100
+STEPS = 150
+TILES = (1, 7, 64, 4096)
+
+class IterateNTest(unittest.TestCase):
+
+    def make(self, core, dtype, position, field, kind, wave, boundary):
+        return core.FDTD1(0.1, N, position, source_field=field, source_type=kind,
+                          source_wave=wave, boundary_type=boundary, dtype=dtype)
+
+    def assertFieldsEqual(self, a, b, dtype):
+        #the fused and tiled loops can round float64 differently at ~1e-16
+        for x, y in ((a.Ez, b.Ez), (a.Hy, b.Hy), (a._mur, b._mur)):
+            if dtype is np.float32:
+                np.testing.assert_array_equal(x, y)
+            else:
+                np.testing.assert_allclose(x, y, rtol=0, atol=1e-12)
+        self.assertEqual(a.time_step, b.time_step)
+
+    def check_backend(self, core):
+        for dtype in (np.float32, np.float64):
+            for field in core.Field:
+                for kind in core.Source:
+                    for wave in core.Wave:
+                        for boundary in core.Boundary:
+                            for position in (1, 40, N-2):
+                                args = (core, dtype, position, field, kind, wave, boundary)
+                                with self.subTest(args=args[1:]):
+                                    self.check_case(*args)
+
+    def check_case(self, *args):
+        dtype = args[1]
+        ref = self.make(*args)
+        snapshots = []
+        for n in range(STEPS):
+            ref.iterate()
+            if (n+1) % 10 == 0:
+                snapshots.append(ref.Ez.copy())
+
+        for tile in TILES:
+            sim = self.make(*args)
+            sim.iterate_n(STEPS//3, tile=tile)
+            sim.iterate()
+            sim.iterate_n(STEPS - STEPS//3 - 1, tile=tile)
+            self.assertFieldsEqual(ref, sim, dtype)
+
+        sim = self.make(*args)
+        sampled = sim.iterate_n(STEPS, tile=7, sample_every=10)
+        self.assertEqual(sampled.shape, (STEPS//10, N))
+        if dtype is np.float32:
+            np.testing.assert_array_equal(sampled, np.array(snapshots))
+        else:
+            np.testing.assert_allclose(sampled, np.array(snapshots), rtol=0, atol=1e-12)
+        self.assertFieldsEqual(ref, sim, dtype)
+
+    def test_numpy(self):
+        self.check_backend(BACKENDS['numpy'])
+
+    @unittest.skipIf(BACKENDS['numba'] is None, "numba is not installed")
+    def test_numba(self):
+        self.check_backend(BACKENDS['numba'])
+
+    @unittest.skipIf(BACKENDS['cython'] is None, "_stencil is not built")
+    def test_cython(self):
+        self.check_backend(BACKENDS['cython'])
+
+    def test_bad_arguments(self):
+        core = BACKENDS['numpy']
+        sim = core.FDTD1(0.1, N, 40)
+        for kwargs in (dict(n_steps=-1), dict(n_steps=5, tile=0),
+                       dict(n_steps=5, sample_every=0)):
+            with self.subTest(kwargs=kwargs):
+                with self.assertRaises(ValueError):
+                    sim.iterate_n(**kwargs)
+        with self.assertRaises(ValueError):
+            core.FDTD1(0.1, N, N-1, source_field=core.Field.MAGNETIC)
+
+if __name__ == "__main__":
+    unittest.main()